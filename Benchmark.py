@@ -0,0 +1,341 @@
+"""
+Arcore 性能测试
+=
+用法:
+
+    python Benchmark.py memory [count]
+        生成含 count 个物件(默认1000000)的合成谱面,
+        分别统计普通类(带__dict__)与__slots__类每个物件占用的字节数。
+
+    python Benchmark.py cache [count]
+        生成含 count 个物件(默认200000)的合成谱面文件,
+        比较直接解析(冷启动)与从 ChartCache 读取(热启动)的耗时。
+
+    python Benchmark.py suite [sizes] [output]
+        对逗号分隔的各个物件数量(默认1000,10000,100000,1000000)生成合成谱面,
+        测量 Chart.ReadFile / AFFStatements2AFFObjectList / Chart.SaveFile / 读写往返的耗时和内存峰值,
+        结果以 JSON 写入 output(默认 benchmark.json)。
+
+    python Benchmark.py compare old.json new.json
+        比较两次 suite 的结果, 列出每项耗时和内存峰值的变化。
+"""
+
+
+import os
+import sys
+import json
+import time
+import random
+import platform
+import shutil
+import tempfile
+import tracemalloc
+
+import Arcore
+
+def _GenerateObjects(objecttypes, count, seed=0):
+    """
+    按固定随机种子生成 count 个物件, 各类型轮流出现。
+
+    参数:
+        objecttypes (dict): 类型名 -> 物件类, 需要包含 Note/Hold/Arc/Timing/SceneControl/Camera。
+        count (int): 物件数量。
+        seed (int): 随机种子。
+
+    返回:
+        物件列表。
+    """
+    rng = random.Random(seed)
+    Note, Hold, Arc = objecttypes['Note'], objecttypes['Hold'], objecttypes['Arc']
+    Timing, SceneControl, Camera = objecttypes['Timing'], objecttypes['SceneControl'], objecttypes['Camera']
+    objects = []
+    for i in range(count):
+        starttime = i*10
+        kind = i % 10
+        if kind < 4:
+            objects.append(Note(starttime, rng.randint(1, 4)))
+        elif kind < 6:
+            objects.append(Hold(starttime, starttime+rng.randint(100, 1000), rng.randint(1, 4)))
+        elif kind < 9:
+            arctaplist = [starttime+50*j for j in range(rng.randint(0, 3))]
+            objects.append(Arc(starttime, starttime+500, rng.random(), rng.random(), 's', rng.random(), rng.random(), rng.randint(0, 1), "none", "true" if arctaplist else "false", arctaplist))
+        elif i % 20 == 9:
+            objects.append(Timing(starttime, 120.0+rng.randint(0, 60), 4.0))
+        elif i % 40 == 19:
+            objects.append(SceneControl(starttime, "trackdisplay", 1.0, 255))
+        else:
+            objects.append(Camera(starttime, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 'qi', 100))
+    return objects
+
+_GROUP_ATTRIBUTES = ("", "noinput", "fadingholds", "anglex3600", "noinput_fadingholds")
+
+def GenerateChart(notes=0, holds=0, arcs=0, arctaps=0, timings=1, scenecontrols=0, cameras=0, timinggroups=0, groupdepth=1, seed=0):
+    """
+    按固定随机种子生成合成谱面, 同样的参数总是得到同样的谱面。
+
+    物件随机分配到主时间组和各时间组中, 每个时间组内按 starttime 排序。
+    时间组每 groupdepth 个组成一条嵌套链: 第一个位于主时间组, 之后每个嵌套在前一个之中。
+
+    参数:
+        notes/holds/arcs (int): Note/Hold/Arc 数量。
+        arctaps (int): Arctap 总数, 随机分配到各条音弧上。
+        timings (int): Timing 总数, 至少为 timinggroups+1, 每个时间组(含主时间组)都有一个 starttime=0 的时间语句。
+        scenecontrols/cameras (int): SceneControl/Camera 数量。
+        timinggroups (int): 时间组数量。
+        groupdepth (int): 时间组嵌套的最大层数。默认值为1, 即不嵌套。
+        seed (int): 随机种子。
+
+    返回:
+        Chart。
+    """
+    rng = random.Random(seed)
+    grouplists = [[]]
+    groupdepth = max(groupdepth, 1)
+    for i in range(timinggroups):
+        parent = grouplists[0] if i % groupdepth == 0 else grouplists[-1]
+        group = Arcore.TimingGroup(_GROUP_ATTRIBUTES[i % len(_GROUP_ATTRIBUTES)])
+        parent.append(group)
+        grouplists.append(group.timinggroupobjectlist)
+    objects = [[] for _ in grouplists]
+    for objects_ in objects:
+        objects_.append(Arcore.Timing(0, 120.0+rng.randint(0, 60), 4.0))
+    span = 10*max(notes+holds+arcs+timings+scenecontrols+cameras, 1)
+    place = lambda obj: objects[rng.randrange(len(objects))].append(obj)
+    for _ in range(notes):
+        place(Arcore.Note(rng.randrange(span), rng.randint(1, 4)))
+    for _ in range(holds):
+        starttime = rng.randrange(span)
+        place(Arcore.Hold(starttime, starttime+rng.randint(100, 1000), rng.randint(1, 4)))
+    arclist = []
+    for _ in range(arcs):
+        starttime = rng.randrange(span)
+        arc = Arcore.Arc(starttime, starttime+rng.randint(100, 1000), round(rng.random(), 2), round(rng.random(), 2),
+                         rng.choice(('b', 's', 'si', 'so', 'sisi', 'soso')), round(rng.random(), 2), round(rng.random(), 2),
+                         rng.randint(0, 1), "none", "false", [])
+        arclist.append(arc)
+        place(arc)
+    for _ in range(arctaps if arclist else 0):
+        arc = arclist[rng.randrange(len(arclist))]
+        arc.arctaplist.append(rng.randint(arc.starttime, arc.endtime))
+        arc.isvoid = "true"
+    for _ in range(max(timings - len(grouplists), 0)):
+        place(Arcore.Timing(rng.randrange(span), 120.0+rng.randint(0, 60), 4.0))
+    for _ in range(scenecontrols):
+        place(Arcore.SceneControl(rng.randrange(span), "trackdisplay", 1.0, rng.randint(0, 1)))
+    for _ in range(cameras):
+        place(Arcore.Camera(rng.randrange(span), 0.0, rng.randint(0, 450), 0.0, 0.0, 0.0, 0.0, rng.choice(('qi', 'qo', 'l')), rng.randint(0, 500)))
+    for arc in arclist:
+        arc.arctaplist.sort()
+    for grouplist, objects_ in zip(grouplists, objects):
+        objects_.sort(key=lambda obj: obj.starttime)
+        grouplist[:0] = objects_
+    return Arcore.Chart(0, 1.0, grouplists[0])
+
+def GenerateChartOfSize(count, seed=0):
+    """
+    生成约含 count 个物件的合成谱面, 各类物件比例接近常见谱面:
+    Note 40%, Hold 20%, Arc 30%(平均每条1个Arctap), Timing/SceneControl/Camera 各约3%,
+    每5000个物件一个时间组, 最多嵌套两层。
+
+    参数:
+        count (int): 物件数量。
+        seed (int): 随机种子。
+
+    返回:
+        Chart。
+    """
+    timinggroups = count//5000
+    return GenerateChart(notes=count*40//100, holds=count*20//100, arcs=count*30//100, arctaps=count*30//100,
+                         timings=max(count*3//100, timinggroups+1), scenecontrols=count*3//100, cameras=count*3//100,
+                         timinggroups=timinggroups, groupdepth=2, seed=seed)
+
+def _UnslottedTypes():
+    """
+    返回与 Arcore 中物件类初始化方式相同、但使用__dict__存储属性的类, 作为对照组。
+    """
+    return {name: type(name, (), {'__init__': getattr(Arcore, name).__init__})
+            for name in ('Note', 'Hold', 'Arc', 'Timing', 'SceneControl', 'Camera')}
+
+def _MeasureBytes(objecttypes, count):
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    objects = _GenerateObjects(objecttypes, count)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    del objects
+    return used
+
+def MeasureObjectMemory(count=1000000):
+    """
+    统计合成谱面中每个物件平均占用的字节数(含属性值与 Arctap 列表, 含物件列表本身)。
+
+    参数:
+        count (int): 物件数量。默认值为1000000。
+
+    返回:
+        dict: {"count": 物件数量, "dict": 普通类每物件字节数, "slots": __slots__类每物件字节数}
+    """
+    slotted = {name: getattr(Arcore, name) for name in ('Note', 'Hold', 'Arc', 'Timing', 'SceneControl', 'Camera')}
+    return {
+        "count": count,
+        "dict": _MeasureBytes(_UnslottedTypes(), count)/count,
+        "slots": _MeasureBytes(slotted, count)/count,
+    }
+
+def MeasureCache(count=200000):
+    """
+    比较解析合成谱面文件与从 ChartCache 读取同一文件的耗时(秒)。
+
+    参数:
+        count (int): 物件数量。默认值为200000。
+
+    返回:
+        dict: {"count", "bytes", "cold": 解析并写入缓存, "warm": 读取缓存得到 ChartTable, "warmchart": 读取缓存并还原为 Chart}
+    """
+    slotted = {name: getattr(Arcore, name) for name in ('Note', 'Hold', 'Arc', 'Timing', 'SceneControl', 'Camera')}
+    directory = tempfile.mkdtemp()
+    try:
+        AFFPath = os.path.join(directory, 'chart.aff')
+        Arcore.Chart(0, 1.0, [Arcore.Timing(0, 120.0, 4.0)] + _GenerateObjects(slotted, count)).SaveFile(AFFPath)
+        cache = Arcore.ChartCache(os.path.join(directory, 'cache'))
+        result = {"count": count, "bytes": os.path.getsize(AFFPath)}
+        for name, read in (("cold", cache.ReadFile), ("warm", cache.ReadFile), ("warmchart", cache.ReadChart)):
+            start = time.perf_counter()
+            read(AFFPath)
+            result[name] = time.perf_counter() - start
+        return result
+    finally:
+        shutil.rmtree(directory)
+
+def _Measure(function, repeat, memory):
+    """
+    运行 function repeat 次取最短耗时; memory 为True时再单独运行一次, 用 tracemalloc 统计内存峰值。
+    """
+    seconds = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        seconds = min(seconds, time.perf_counter() - start)
+    peakbytes = None
+    if memory:
+        tracemalloc.start()
+        try:
+            function()
+            peakbytes = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+    return seconds, peakbytes
+
+def RunSuite(sizes=(1000, 10000, 100000, 1000000), repeat=3, memory=True, seed=0):
+    """
+    对每个物件数量生成合成谱面(GenerateChartOfSize), 测量以下操作的耗时(秒, 取 repeat 次中最短)和内存峰值(字节):
+
+        ReadFile: Chart.ReadFile 读取谱面文件;
+        AFFStatements2AFFObjectList: 解析不含谱面头的 AFF 文本;
+        SaveFile: Chart.SaveFile 保存谱面文件;
+        RoundTrip: 读取谱面文件后再保存。
+
+    参数:
+        sizes (list of int): 物件数量。
+        repeat (int): 每项重复次数。默认值为3。
+        memory (bool): 是否统计内存峰值(会额外运行一次)。默认值为True。
+        seed (int): 随机种子。
+
+    返回:
+        dict: {"version", "python", "platform", "numpy", "results": [{"name", "size", "bytes", "seconds", "peakbytes"}]}
+    """
+    results = []
+    directory = tempfile.mkdtemp()
+    try:
+        AFFPath = os.path.join(directory, 'chart.aff')
+        OutputPath = os.path.join(directory, 'output.aff')
+        for size in sizes:
+            chart = GenerateChartOfSize(size, seed)
+            chart.SaveFile(AFFPath)
+            with open(AFFPath, 'r') as file:
+                statements = file.read().split("\n-\n", 1)[1]
+            def ReadFile():
+                Arcore.Chart().ReadFile(AFFPath)
+            def RoundTrip():
+                loaded = Arcore.Chart()
+                loaded.ReadFile(AFFPath)
+                loaded.SaveFile(OutputPath)
+            benchmarks = (
+                ("ReadFile", ReadFile),
+                ("AFFStatements2AFFObjectList", lambda statements=statements: Arcore.AFFStatements2AFFObjectList(statements)),
+                ("SaveFile", lambda chart=chart: chart.SaveFile(OutputPath)),
+                ("RoundTrip", RoundTrip),
+            )
+            for name, function in benchmarks:
+                seconds, peakbytes = _Measure(function, repeat, memory)
+                results.append({"name": name, "size": size, "bytes": os.path.getsize(AFFPath), "seconds": seconds, "peakbytes": peakbytes})
+            del chart, statements, benchmarks
+    finally:
+        shutil.rmtree(directory)
+    return {
+        "version": 1,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "numpy": Arcore.np.__version__ if Arcore.np is not None else None,
+        "results": results,
+    }
+
+def CompareResults(old, new):
+    """
+    比较两次 RunSuite 的结果。
+
+    参数:
+        old (dict): 旧结果。
+        new (dict): 新结果。
+
+    返回:
+        list of dict: 两次都有的每一项 {"name", "size", "seconds": (旧, 新, 新/旧), "peakbytes": (旧, 新, 新/旧)}。
+    """
+    oldresults = {(result["name"], result["size"]): result for result in old["results"]}
+    comparison = []
+    for result in new["results"]:
+        previous = oldresults.get((result["name"], result["size"]))
+        if previous is None:
+            continue
+        item = {"name": result["name"], "size": result["size"]}
+        for key in ("seconds", "peakbytes"):
+            a, b = previous[key], result[key]
+            item[key] = (a, b, b/a if a and b is not None else None)
+        comparison.append(item)
+    return comparison
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 2 and sys.argv[1] == 'memory':
+        result = MeasureObjectMemory(int(sys.argv[2]) if len(sys.argv) >= 3 else 1000000)
+        print(f"物件数量: {result['count']}")
+        print(f"__dict__: {result['dict']:.1f} 字节/物件")
+        print(f"__slots__: {result['slots']:.1f} 字节/物件")
+        print(f"节省: {1-result['slots']/result['dict']:.1%}")
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'cache':
+        result = MeasureCache(int(sys.argv[2]) if len(sys.argv) >= 3 else 200000)
+        print(f"物件数量: {result['count']}, 文件大小: {result['bytes']} 字节")
+        print(f"解析并写入缓存: {result['cold']:.3f} 秒")
+        print(f"读取缓存(ChartTable): {result['warm']:.4f} 秒, {result['cold']/result['warm']:.0f} 倍")
+        print(f"读取缓存并还原为 Chart: {result['warmchart']:.3f} 秒")
+    elif len(sys.argv) >= 2 and sys.argv[1] == 'suite':
+        sizes = [int(size) for size in sys.argv[2].split(',')] if len(sys.argv) >= 3 else (1000, 10000, 100000, 1000000)
+        output = sys.argv[3] if len(sys.argv) >= 4 else 'benchmark.json'
+        result = RunSuite(sizes)
+        with open(output, 'w') as file:
+            json.dump(result, file, indent=1)
+        for item in result["results"]:
+            print(f"{item['name']:<28} {item['size']:>8} 物件: {item['seconds']:.4f} 秒, 峰值 {item['peakbytes']/2**20:.1f} MiB")
+        print(f"结果已写入 {output}")
+    elif len(sys.argv) >= 4 and sys.argv[1] == 'compare':
+        with open(sys.argv[2]) as file:
+            old = json.load(file)
+        with open(sys.argv[3]) as file:
+            new = json.load(file)
+        for item in CompareResults(old, new):
+            seconds, peakbytes = item["seconds"], item["peakbytes"]
+            line = f"{item['name']:<28} {item['size']:>8} 物件: {seconds[0]:.4f} -> {seconds[1]:.4f} 秒 ({seconds[2]:.2f}x)"
+            if peakbytes[2] is not None:
+                line += f", 峰值 {peakbytes[2]:.2f}x"
+            print(line)
+    else:
+        print(__doc__)